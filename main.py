@@ -4,6 +4,7 @@ import hydra
 from dotenv import load_dotenv
 from hydra.core.config_store import ConfigStore
 
+from src.pipeline import main as pipeline_main
 from src.step1_convert import main as convert_main
 from src.step2_answer import main as answer_main
 from src.step3_judge import main as judge_main
@@ -34,13 +35,19 @@ def run_experiment(cfg: RunConfig):
         )
         convert_main(cfg)
 
-    if cfg.steps.answer:
-        log.info(f"Step 2: Answering questions using {cfg.answer.model}")
-        answer_main(cfg)
-
-    if cfg.steps.judge:
-        log.info(f"Step 3: Judging answers using {cfg.judge.model}")
-        judge_main(cfg)
+    if cfg.steps.answer and cfg.steps.judge and cfg.steps.pipeline:
+        log.info(
+            f"Steps 2 and 3: Answering questions using {cfg.answer.model} and judging answers using {cfg.judge.model} in a pipeline"
+        )
+        pipeline_main(cfg)
+    else:
+        if cfg.steps.answer:
+            log.info(f"Step 2: Answering questions using {cfg.answer.model}")
+            answer_main(cfg)
+
+        if cfg.steps.judge:
+            log.info(f"Step 3: Judging answers using {cfg.judge.model}")
+            judge_main(cfg)
 
     log.info("Experiment pipeline completed")
 
@@ -3,6 +3,7 @@ from docling.datamodel.pipeline_options import (
     PdfPipelineOptions,
     PictureDescriptionApiOptions,
 )
+from docling.datamodel.settings import settings
 from docling.document_converter import (
     DocumentConverter,
     PdfFormatOption,
@@ -11,7 +12,10 @@ from docling.document_converter import (
 
 
 def setup_docling_converter(
-    model: str, img_prompt: str, artifacts_path: str | None = None
+    model: str,
+    img_prompt: str,
+    artifacts_path: str | None = None,
+    page_batch_size: int | None = None,
 ) -> DocumentConverter:
     """
     Set up DocumentConverter with LLM-based image description capabilities.
@@ -22,7 +26,12 @@ def setup_docling_converter(
         img_prompt: Prompt to use for the image captioning task.
         artifacts_path: Optional path to pre-fetched Docling models. If not
             supplied, models are found or downloaded at runtime.
+        page_batch_size: Optional number of pages that Docling runs through
+            its models at once. Larger batches keep a GPU busier on long
+            documents. This is a process-wide Docling setting.
     """
+    if page_batch_size is not None:
+        settings.perf.page_batch_size = page_batch_size
 
     # Enable picture descriptions via remote LLM APIs
     # https://ds4sd.github.io/docling/examples/pictures_description_api/
@@ -58,9 +67,18 @@ def setup_docling_converter(
     return doc_converter
 
 
-def run_docling(input_doc_path: str, model: str, img_prompt: str) -> str:
-    """Convert document to markdown using Docling with LLM-generated image descriptions."""
-    doc_converter = setup_docling_converter(model=model, img_prompt=img_prompt)
+def run_docling(
+    input_doc_path: str,
+    model: str,
+    img_prompt: str,
+    doc_converter: DocumentConverter | None = None,
+) -> str:
+    """
+    Convert document to markdown using Docling with LLM-generated image descriptions.
+    Pass a doc_converter from setup_docling_converter to reuse it across documents.
+    """
+    if doc_converter is None:
+        doc_converter = setup_docling_converter(model=model, img_prompt=img_prompt)
     result = doc_converter.convert(input_doc_path)
     markdown_string = result.document.export_to_markdown()
     return markdown_string
@@ -8,8 +8,18 @@ from marker.output import text_from_rendered
 log = logging.getLogger(__name__)
 
 
-def run_marker(file_path: str, model: str | None) -> str:
-    """Convert PDF to markdown using Marker with optional LLM-based image captioning."""
+def setup_marker_converter(
+    model: str | None, artifact_dict: dict | None = None
+) -> PdfConverter:
+    """
+    Set up a Marker PdfConverter with optional LLM-based image captioning.
+
+    Args:
+        model: Name of the model to use for image captioning. Must be registered
+            on a running litellm proxy. If None, no LLM is used.
+        artifact_dict: Optional pre-loaded Marker models from create_model_dict.
+            If not supplied, the models are loaded here.
+    """
     config = {"output_format": "markdown"}
 
     if model is not None:
@@ -29,12 +39,25 @@ def run_marker(file_path: str, model: str | None) -> str:
 
     converter = PdfConverter(
         config=config_parser.generate_config_dict(),
-        artifact_dict=create_model_dict(),
+        artifact_dict=artifact_dict or create_model_dict(),
         processor_list=config_parser.get_processors(),
         renderer=config_parser.get_renderer(),
         llm_service=config_parser.get_llm_service(),
     )
 
+    return converter
+
+
+def run_marker(
+    file_path: str, model: str | None, converter: PdfConverter | None = None
+) -> str:
+    """
+    Convert PDF to markdown using Marker with optional LLM-based image captioning.
+    Pass a converter from setup_marker_converter to reuse it across documents.
+    """
+    if converter is None:
+        converter = setup_marker_converter(model=model)
+
     rendered = converter(file_path)
     result, _, _ = text_from_rendered(rendered)
 
@@ -1,5 +1,7 @@
 import logging
+import os
 import subprocess
+import tempfile
 import time
 from contextlib import contextmanager
 from pathlib import Path
@@ -8,6 +10,13 @@ import modal
 
 log = logging.getLogger(__name__)
 
+# Documents up to this size are sent to the functions as bytes instead of
+# being read from the mounted bucket, which costs an S3 GET per call
+INLINE_DOCUMENT_MAX_BYTES = 4 * 1024 * 1024
+
+# A document to convert: its filename and, for small files, its content
+Document = tuple[str, bytes | None]
+
 
 # Use an S3 bucket to supply documents to functions running on Modal
 # https://modal.com/docs/guide/cloud-bucket-mounts
@@ -63,16 +72,20 @@ def check_proxy_health() -> bool:
 def wait_for_proxy_start(timeout: int = 30):
     """
     Wait until a locally running litellm proxy is ready.
+    Polls with exponential backoff (0.1s, 0.2s, 0.4s, ...) capped at 1s.
     """
     # Check if the proxy is ready to accept connections
     proxy_ready = False
-    for _ in range(timeout):
+    deadline = time.monotonic() + timeout
+    delay = 0.1
+    while time.monotonic() < deadline:
         if check_proxy_health():
             proxy_ready = True
             print("LiteLLM proxy is ready")
             break
 
-        time.sleep(1)
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
 
     if not proxy_ready:
         raise RuntimeError(
@@ -80,6 +93,35 @@ def wait_for_proxy_start(timeout: int = 30):
         )
 
 
+def load_document(file_path: str) -> Document:
+    """
+    Prepare a local file for remote conversion. Small files are read so their
+    bytes can be sent along; larger files are left to be read from the bucket.
+    """
+    file = os.path.basename(file_path)
+    if os.path.getsize(file_path) <= INLINE_DOCUMENT_MAX_BYTES:
+        with open(file_path, "rb") as f:
+            return file, f.read()
+    return file, None
+
+
+@contextmanager
+def document_path(file: str, content: bytes | None):
+    """
+    Yield a path to a document inside a Modal container. Uses the mounted
+    bucket unless the content was sent along, in which case it's written to a
+    temporary file with the same name so the file type can be detected.
+    """
+    if content is None:
+        yield "/bucket/" + file
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = Path(temp_dir) / file
+        path.write_bytes(content)
+        yield str(path)
+
+
 @contextmanager
 def timing_context():
     start = time.time()
@@ -101,25 +143,35 @@ markitdown_image = (
 )
 
 
-@app.function(image=markitdown_image, volumes={"/bucket": bucket_mount}, timeout=1800)
-def run_markitdown_modal(file: str, model: str | None = None) -> str:
+@app.cls(image=markitdown_image, volumes={"/bucket": bucket_mount}, timeout=1800)
+class MarkitdownWorker:
     """
-    Convert a document that is located on a mounted bucket to Markdown using MarkItDown.
+    Convert documents to Markdown using MarkItDown. An empty model disables
+    LLM image descriptions.
     """
-    from src.convert_markitdown import run_markitdown
 
-    proxy = None
-    if model:
-        proxy = start_litellm_proxy()
-        wait_for_proxy_start()
+    model: str = modal.parameter(default="")
+
+    @modal.enter()
+    def load(self):
+        self.proxy = None
+        if self.model:
+            self.proxy = start_litellm_proxy()
+            wait_for_proxy_start()
 
-    with timing_context():
-        md = run_markitdown(file="/bucket/" + file, model=model)
+    @modal.exit()
+    def cleanup(self):
+        if self.proxy:
+            self.proxy.terminate()
 
-    if proxy:
-        proxy.terminate()
+    @modal.method()
+    def run(self, file: str, content: bytes | None = None) -> str:
+        from src.convert_markitdown import run_markitdown
 
-    return md
+        with document_path(file, content) as path, timing_context():
+            md = run_markitdown(file=path, model=self.model or None)
+
+        return md
 
 
 # MARKER
@@ -148,25 +200,46 @@ marker_image = (
 )
 
 
-@app.function(
+@app.cls(
     image=marker_image,
     volumes={"/bucket": bucket_mount},
     gpu="T4",
     max_containers=10,
     timeout=3600,
 )
-def run_marker_modal(file: str, model: str) -> str:
-    from src.convert_marker import run_marker
+class MarkerWorker:
+    """
+    Convert documents to Markdown using Marker. The models are loaded once per
+    container and reused across calls.
+    """
+
+    model: str = modal.parameter()
 
-    proxy = start_litellm_proxy()
-    wait_for_proxy_start()
+    @modal.enter()
+    def load(self):
+        from src.convert_marker import setup_marker_converter
 
-    with timing_context():
-        md = run_marker(file_path="/bucket/" + file, model=model)
+        # Start the proxy first so it boots while the models are loading
+        self.proxy = start_litellm_proxy()
+        self.converter = setup_marker_converter(model=self.model)
+        wait_for_proxy_start()
+
+    @modal.exit()
+    def cleanup(self):
+        self.proxy.terminate()
+
+    @modal.method()
+    def run(self, file: str, content: bytes | None = None) -> str:
+        from src.convert_marker import run_marker
 
-    proxy.terminate()
+        with document_path(file, content) as path, timing_context():
+            md = run_marker(
+                file_path=path,
+                model=self.model,
+                converter=self.converter,
+            )
 
-    return md
+        return md
 
 
 # ZEROX
@@ -182,25 +255,38 @@ zerox_image = (
 )
 
 
-@app.function(image=zerox_image, volumes={"/bucket": bucket_mount}, timeout=900)
-def run_zerox_modal(file: str, model: str) -> str:
+@app.cls(image=zerox_image, volumes={"/bucket": bucket_mount}, timeout=900)
+class ZeroxWorker:
     """
-    Convert a document that is located on a mounted bucket to Markdown using Zerox.
+    Convert documents to Markdown using Zerox.
     """
-    from src.convert_zerox import run_zerox
 
-    proxy = start_litellm_proxy()
-    wait_for_proxy_start()
+    model: str = modal.parameter()
+
+    @modal.enter()
+    def load(self):
+        self.proxy = start_litellm_proxy()
+        wait_for_proxy_start()
 
-    with timing_context():
-        md = run_zerox(file_path="/bucket/" + file, model=model)
+    @modal.exit()
+    def cleanup(self):
+        self.proxy.terminate()
 
-    proxy.terminate()
+    @modal.method()
+    def run(self, file: str, content: bytes | None = None) -> str:
+        from src.convert_zerox import run_zerox
 
-    return md
+        with document_path(file, content) as path, timing_context():
+            md = run_zerox(file_path=path, model=self.model)
+
+        return md
 
 
 # DOCLING
+# Pages are processed in batches on the GPU; the default batch of 4 pages
+# leaves the A10G underused on long reports
+DOCLING_PAGE_BATCH_SIZE = 16
+
 # Pre-fetch the models and bake them into the image for faster start times
 # https://docling-project.github.io/docling/usage/#model-prefetching-and-offline-usage
 # Add litellm proxy to route and cache LLM requests
@@ -213,33 +299,63 @@ docling_image = (
 )
 
 
-@app.function(
+@app.cls(
     image=docling_image,
     volumes={"/bucket": bucket_mount},
     gpu="A10G",
     max_containers=10,
     timeout=1800,
 )
-def run_docling_modal(file: str, model: str, img_prompt: str) -> str:
+class DoclingWorker:
     """
-    Convert a document that is located on a mounted bucket to Markdown using Docling.
+    Convert documents to Markdown using Docling. The converter is set up once
+    per container and reused across calls.
     """
-    from src.convert_docling import run_docling
 
-    proxy = start_litellm_proxy()
-    wait_for_proxy_start()
+    model: str = modal.parameter()
+    img_prompt: str = modal.parameter()
+
+    @modal.enter()
+    def load(self):
+        from docling.datamodel.base_models import InputFormat
+
+        from src.convert_docling import setup_docling_converter
 
-    with timing_context():
-        md = run_docling(
-            input_doc_path="/bucket/" + file, model=model, img_prompt=img_prompt
+        # Start the proxy first so it boots while the models are loading
+        self.proxy = start_litellm_proxy()
+        self.doc_converter = setup_docling_converter(
+            model=self.model,
+            img_prompt=self.img_prompt,
+            page_batch_size=DOCLING_PAGE_BATCH_SIZE,
         )
+        # Docling loads the pipeline models lazily on the first conversion
+        self.doc_converter.initialize_pipeline(InputFormat.PDF)
+        wait_for_proxy_start()
+
+    @modal.exit()
+    def cleanup(self):
+        self.proxy.terminate()
+
+    @modal.method()
+    def run(self, file: str, content: bytes | None = None) -> str:
+        from src.convert_docling import run_docling
 
-    proxy.terminate()
+        with document_path(file, content) as path, timing_context():
+            md = run_docling(
+                input_doc_path=path,
+                model=self.model,
+                img_prompt=self.img_prompt,
+                doc_converter=self.doc_converter,
+            )
 
-    return md
+        return md
 
 
 def main(files: list[str], lib: str, model: str, img_prompt: str):
+    """
+    Convert local files to markdown on Modal. Files must also be uploaded to
+    the S3 bucket under their base filename, which is used for large files.
+    """
     if len(files) == 0:
         return []
 
@@ -247,34 +363,31 @@ def main(files: list[str], lib: str, model: str, img_prompt: str):
         f"Converting {len(files)} document(s) to markdown using {lib} with {model}"
     )
 
-    # Define arguments for parallel remote conversion function invocations
-    args = []
-    for path in files:
-        # Only docling needs an img_prompt
-        if lib == "docling":
-            args.append((path, model, img_prompt))
-        else:
-            args.append((path, model))
-
     # Execute conversions in parallel
     # https://modal.com/docs/guide/scale
     if lib == "docling":
-        md_strings = list(run_docling_modal.starmap(args, return_exceptions=True))
+        worker = DoclingWorker(model=model, img_prompt=img_prompt)
+    elif lib == "marker":
+        worker = MarkerWorker(model=model)
     elif lib == "markitdown":
-        md_strings = list(run_markitdown_modal.starmap(args, return_exceptions=True))
+        worker = MarkitdownWorker(model=model or "")
     elif lib == "zerox":
-        md_strings = list(run_zerox_modal.starmap(args, return_exceptions=True))
-    elif lib == "marker":
-        md_strings = list(run_marker_modal.starmap(args, return_exceptions=True))
+        worker = ZeroxWorker(model=model)
     else:
         raise ValueError(f"Unknown library {lib}")
 
+    # Documents are loaded lazily as Modal consumes the inputs
+    documents = (load_document(path) for path in files)
+    md_strings = list(worker.run.starmap(documents, return_exceptions=True))
+
     assert len(md_strings) == len(files)
 
     error_count = 0
     for i, md in enumerate(md_strings):
         if not isinstance(md, str):
-            error_msg = f"Error converting {files[i]} to markdown: {md}"
+            error_msg = (
+                f"Error converting {os.path.basename(files[i])} to markdown: {md}"
+            )
             log.error(error_msg)
             md_strings[i] = error_msg
             error_count += 1
@@ -1,6 +1,11 @@
-import concurrent.futures
+import asyncio
+import functools
+import hashlib
+import json
 import logging
 import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any
 
@@ -10,36 +15,138 @@ from botocore.config import Config as BotocoreConfig
 from litellm.utils import ModelResponse
 from pydantic import validate_call
 from tenacity import (
-    before_sleep_log,
-    retry,
+    AsyncRetrying,
+    RetryCallState,
+    retry_if_exception_type,
     retry_if_not_exception_type,
     stop_after_attempt,
     wait_random_exponential,
 )
-from tqdm import tqdm
+from tqdm.asyncio import tqdm
 import yaml
 
 
 logger = logging.getLogger(__name__)
 
-litellm.cache = Cache(
-    type="s3",
-    s3_bucket_name=os.environ["LITELLM_CACHE_BUCKET"],
-    s3_region_name=os.environ["LITELLM_CACHE_AWS_REGION"],
-    s3_config=BotocoreConfig(
-        max_pool_connections=int(os.environ.get("LITELLM_MAX_S3_CONNECTIONS"), 10)
+
+def create_cache() -> Cache:
+    """
+    Create the litellm response cache. Uses AWS S3 by default. Set
+    LITELLM_CACHE_TYPE=redis to use a Redis server instead, e.g. one started
+    with config/redis.conf, which answers cache hits with much lower latency.
+    """
+    cache_type = os.environ.get("LITELLM_CACHE_TYPE", "s3")
+
+    if cache_type == "redis":
+        ttl = os.environ.get("LITELLM_CACHE_TTL")
+        return Cache(
+            type="redis",
+            host=os.environ.get("REDIS_HOST", "127.0.0.1"),
+            port=os.environ.get("REDIS_PORT", "6379"),
+            password=os.environ.get("REDIS_PASSWORD"),
+            ttl=float(ttl) if ttl else None,
+        )
+    elif cache_type == "s3":
+        return Cache(
+            type="s3",
+            s3_bucket_name=os.environ["LITELLM_CACHE_BUCKET"],
+            s3_region_name=os.environ["LITELLM_CACHE_AWS_REGION"],
+            s3_config=BotocoreConfig(
+                max_pool_connections=int(
+                    os.environ.get("LITELLM_MAX_S3_CONNECTIONS", 64)
+                ),
+                # Fail fast on slow cache requests instead of blocking completions
+                connect_timeout=2,
+                read_timeout=10,
+                retries={"max_attempts": 3, "mode": "adaptive"},
+            ),
+        )
+    else:
+        raise ValueError(f"Unknown LITELLM_CACHE_TYPE {cache_type}")
+
+
+litellm.cache = create_cache()
+
+DEFAULT_WORKERS = int(os.environ.get("LITELLM_WORKERS", 4))
+DEFAULT_RETRIES = int(os.environ.get("LITELLM_RETRIES", 5))
+
+# In-process LRU in front of the shared cache, so that repeated identical
+# requests within a run are answered without a round trip to S3 or Redis
+LOCAL_CACHE_SIZE = int(os.environ.get("LITELLM_LOCAL_CACHE_SIZE", 4096))
+_local_cache: OrderedDict[str, ModelResponse] = OrderedDict()
+
+
+def _local_cache_key(arg_dict: dict[str, Any]) -> str:
+    """Hash the completion arguments that determine the response."""
+    key_data = {k: v for k, v in arg_dict.items() if k != "timeout"}
+    return hashlib.sha256(
+        json.dumps(key_data, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def _local_cache_get(key: str) -> ModelResponse | None:
+    response = _local_cache.get(key)
+    if response is not None:
+        _local_cache.move_to_end(key)
+    return response
+
+
+def _local_cache_put(key: str, response: ModelResponse):
+    _local_cache[key] = response
+    _local_cache.move_to_end(key)
+    while len(_local_cache) > LOCAL_CACHE_SIZE:
+        _local_cache.popitem(last=False)
+
+
+def log_retry(retry_state: RetryCallState, model: str, chat_index: int):
+    """Log a failed completion attempt before tenacity sleeps and retries it."""
+    logger.warning(
+        f"Retrying completion of chat {chat_index} with {model} in "
+        f"{retry_state.next_action.sleep:.1f}s after attempt "
+        f"{retry_state.attempt_number} failed: {retry_state.outcome.exception()!r}"
+    )
+
+
+# LiteLLM's max_retries parameter doesn't work reliably and lacks
+# customization, so we use tenacity to retry completions. The policy is built
+# once; the number of attempts is set per batch_completion call and the retry
+# log message per completion.
+# Errors that won't go away by retrying the same request are raised directly.
+# Only Exception subclasses are retried, so that cancellation (e.g. on Ctrl-C
+# under asyncio.run) and KeyboardInterrupt stop the completion.
+RETRYING = AsyncRetrying(
+    wait=wait_random_exponential(multiplier=1, max=60),
+    retry=retry_if_exception_type(Exception)
+    & retry_if_not_exception_type(
+        (
+            litellm.BadRequestError,
+            litellm.AuthenticationError,
+            litellm.PermissionDeniedError,
+            litellm.NotFoundError,
+        )
     ),
 )
 
+# Batches up to this size run without a progress bar, whose setup would
+# dominate the runtime of a handful of (often cached) completions
+PROGRESS_BAR_MIN_COMPLETIONS = 3
+
+litellm_config_path = Path(__file__).parent.parent / "config/litellm_config.yaml"
+
+
+@functools.lru_cache(maxsize=1)
+def load_litellm_config() -> dict[str, Any]:
+    """Read and parse the litellm config file once per process."""
+    with open(litellm_config_path, "r") as f:
+        return yaml.safe_load(f)
+
 
 def resolve_litellm_model_name(model: str) -> str:
     """
     Look up the short model name in the litellm config file and return the full
     path of the model.
     """
-    litellm_config_path = Path(__file__).parent.parent / "config/litellm_config.yaml"
-    with open(litellm_config_path, "r") as f:
-        litellm_config = yaml.safe_load(f)
+    litellm_config = load_litellm_config()
 
     model_list = litellm_config.get("model_list", [])
     for model_entry in model_list:
@@ -51,20 +158,21 @@ def resolve_litellm_model_name(model: str) -> str:
     raise ValueError(f"model_name {model} not found in {litellm_config_path}")
 
 
-@validate_call(validate_return=True, config=dict(arbitrary_types_allowed=True))
-def batch_completion(
+async def abatch_completion(
     chats: list[list[dict[str, Any]]],
     model: str,
     temperature: float | None = None,
     timeout: float = 300.0,
-    workers: int = int(os.environ.get("LITELLM_WORKERS", 4)),
-    retries: int = int(os.environ.get("LITELLM_RETRIES", 5)),
+    workers: int = DEFAULT_WORKERS,
+    retries: int = DEFAULT_RETRIES,
     tools: list[dict[str, Any]] | None = None,
     tool_choice: dict[str, Any] | None = None,
+    max_tokens: int | None = None,
 ) -> list[ModelResponse]:
     """
     Run a batch of chat completions using litellm. Requests are cached.
-    A progress bar is displayed and logs written.
+    A progress bar is displayed and logs written. This is the async version of
+    batch_completion, for use inside a running event loop.
 
     Args:
         chats: The chats to complete. Can be a single Chat or a list of Chats.
@@ -73,13 +181,16 @@ def batch_completion(
             to not pass this argument to the API. Not all models support setting
             the temperature.
         timeout: The timeout in seconds for an individual completion.
-        workers: The number of workers to use. If 1, the completions are run
-            sequentially. If > 1, the completions are run in parallel using
-            concurrent.futures.ThreadPoolExecutor. This doesn't consider rate
-            limits, so don't set it too high.
+        workers: The maximum number of completions in flight at once. If 1, the
+            completions are run sequentially. If > 1, they are run concurrently
+            in a thread pool. This doesn't consider rate limits, so
+            don't set it too high.
         retries: The number of times to retry a completion if it fails.
         tools: The tools to use for completions.
         tool_choice: The tool choice to use for completions.
+        max_tokens: The maximum number of tokens to generate per completion.
+            Set to None to not pass this argument to the API. For reasoning
+            models, this includes the reasoning tokens.
 
     Returns:
         List of completions.
@@ -97,25 +208,77 @@ def batch_completion(
     # Prepare arguments for completions
     arg_dicts = []
     for chat in chats:
-        arg_dict = {"messages": chat, "model": model, "timeout": timeout}
+        # Retries are handled by tenacity, so the provider SDK must not retry
+        arg_dict = {
+            "messages": chat,
+            "model": model,
+            "timeout": timeout,
+            "max_retries": 0,
+        }
         if temperature is not None:
             arg_dict["temperature"] = temperature
         if tools is not None:
             arg_dict["tools"] = tools
         if tool_choice is not None:
             arg_dict["tool_choice"] = tool_choice
+        if max_tokens is not None:
+            arg_dict["max_tokens"] = max_tokens
         arg_dicts.append(arg_dict)
 
-    # LiteLLM's max_retries parameter doesn't work reliably and lacks
-    # customization, so we use tenacity to retry completions
-    @retry(
-        wait=wait_random_exponential(multiplier=1, max=60),
-        stop=stop_after_attempt(retries + 1),
-        before_sleep=before_sleep_log(logger, logging.WARNING),
-        retry=retry_if_not_exception_type((KeyboardInterrupt, litellm.BadRequestError)),
-    )
-    def generate_completion(arg_dict: dict) -> litellm.utils.ModelResponse:
-        return litellm.completion(**arg_dict)
+    retrying = RETRYING.copy(stop=stop_after_attempt(retries + 1))
+    loop = asyncio.get_running_loop()
+
+    async def generate_completion(
+        chat_index: int,
+        arg_dict: dict,
+        semaphore: asyncio.Semaphore,
+        executor: ThreadPoolExecutor,
+        pbar: tqdm,
+    ) -> litellm.utils.ModelResponse:
+        cache_key = _local_cache_key(arg_dict)
+        if (response := _local_cache_get(cache_key)) is not None:
+            pbar.update(1)
+            return response
+
+        # Each completion needs its own copy because retry state is per attempt
+        async for attempt in retrying.copy(
+            before_sleep=functools.partial(
+                log_retry, model=model, chat_index=chat_index
+            )
+        ):
+            with attempt:
+                # Don't hold a slot while backing off between attempts
+                async with semaphore:
+                    # The S3 cache uses blocking boto3 calls even in
+                    # acompletion, which would stall the event loop, so the
+                    # sync completion runs in a thread instead
+                    response = await loop.run_in_executor(
+                        executor, functools.partial(litellm.completion, **arg_dict)
+                    )
+                _local_cache_put(cache_key, response)
+                pbar.update(1)
+                return response
+
+    async def run_completions() -> list[litellm.utils.ModelResponse]:
+        semaphore = asyncio.Semaphore(workers)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            with tqdm(
+                total=len(arg_dicts),
+                desc="Completions",
+                disable=len(arg_dicts) < PROGRESS_BAR_MIN_COMPLETIONS,
+            ) as pbar:
+                responses = await asyncio.gather(
+                    *[
+                        generate_completion(i, arg_dict, semaphore, executor, pbar)
+                        for i, arg_dict in enumerate(arg_dicts)
+                    ]
+                )
+        finally:
+            # Don't block the event loop on requests still running after an
+            # error or cancellation
+            executor.shutdown(wait=False, cancel_futures=True)
+        return responses
 
     # Execute completions
     if len(arg_dicts) < workers:
@@ -125,22 +288,40 @@ def batch_completion(
 
     if workers == 1:
         logger.info("Running completions sequentially")
-
-        responses = [
-            generate_completion(arg_dict)
-            for arg_dict in tqdm(arg_dicts, desc="Completions")
-        ]
-
     else:
-        logger.info(f"Running completions in parallel using {workers} workers")
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-            responses = list(
-                tqdm(
-                    executor.map(generate_completion, arg_dicts),
-                    total=len(arg_dicts),
-                    desc="Completions",
-                )
-            )
+        logger.info(f"Running up to {workers} completions concurrently")
+
+    responses = await run_completions()
 
     return responses
+
+
+@validate_call(validate_return=True, config=dict(arbitrary_types_allowed=True))
+def batch_completion(
+    chats: list[list[dict[str, Any]]],
+    model: str,
+    temperature: float | None = None,
+    timeout: float = 300.0,
+    workers: int = DEFAULT_WORKERS,
+    retries: int = DEFAULT_RETRIES,
+    tools: list[dict[str, Any]] | None = None,
+    tool_choice: dict[str, Any] | None = None,
+    max_tokens: int | None = None,
+) -> list[ModelResponse]:
+    """
+    Run a batch of chat completions using litellm. Requests are cached.
+    Synchronous wrapper around abatch_completion, see there for the arguments.
+    """
+    return asyncio.run(
+        abatch_completion(
+            chats=chats,
+            model=model,
+            temperature=temperature,
+            timeout=timeout,
+            workers=workers,
+            retries=retries,
+            tools=tools,
+            tool_choice=tool_choice,
+            max_tokens=max_tokens,
+        )
+    )
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+
+from src.step2_answer import aprocess_questions, index_reports, load_questions
+from src.step3_judge import aprocess_evaluations
+from src.utils import QuestionAnswer, RunConfig, write_question_answers
+
+log = logging.getLogger(__name__)
+
+# Number of questions answered before their answers are handed to the judge
+PIPELINE_CHUNK_SIZE = 25
+
+
+async def answer_and_judge(
+    cfg: RunConfig,
+) -> tuple[list[QuestionAnswer], list[QuestionAnswer]]:
+    """
+    Answer questions and judge the answers concurrently. Questions are answered
+    in chunks and each chunk is judged while the next one is being answered.
+    The answers file is written as soon as all questions are answered, so the
+    answers are kept even if judging fails. Returns the answered and the
+    evaluated questions.
+    """
+    questions = load_questions(questions_file=cfg.paths.questions_file)
+
+    # Scan the directory and read each report once for all chunks
+    reports_index = await asyncio.to_thread(index_reports, cfg.paths.markdown_dir)
+    report_contents: dict[str, str | None] = {}
+
+    queue: asyncio.Queue[list[QuestionAnswer] | None] = asyncio.Queue()
+    answered = []
+    evaluated = []
+
+    async def answer_task():
+        try:
+            await answer_chunks()
+        finally:
+            # Let the judge finish even if answering fails
+            await queue.put(None)
+
+        await asyncio.to_thread(
+            write_question_answers, answered, cfg.paths.answers_file
+        )
+        log.info(f"Answers saved to {cfg.paths.answers_file}")
+
+    async def answer_chunks():
+        for start in range(0, len(questions), PIPELINE_CHUNK_SIZE):
+            results = await aprocess_questions(
+                questions=questions[start : start + PIPELINE_CHUNK_SIZE],
+                reports_dir=cfg.paths.markdown_dir,
+                model=cfg.answer.model,
+                prompt=cfg.answer.prompt,
+                temperature=cfg.answer.temperature,
+                concurrency=cfg.answer.concurrency,
+                system_prompt=cfg.answer.system_prompt,
+                max_output_tokens=cfg.answer.max_output_tokens,
+                timeout=cfg.answer.timeout,
+                reports_index=reports_index,
+                report_contents=report_contents,
+            )
+            answered.extend(results)
+            # The judge adds evaluations in place, so it gets its own copies
+            await queue.put([result.model_copy(deep=True) for result in results])
+
+    async def judge_task():
+        while (results := await queue.get()) is not None:
+            evaluated.extend(
+                await aprocess_evaluations(
+                    questions=results,
+                    model=cfg.judge.model,
+                    prompt=cfg.judge.prompt,
+                    concurrency=cfg.judge.concurrency,
+                    system_prompt=cfg.judge.system_prompt,
+                    max_output_tokens=cfg.judge.max_output_tokens,
+                    timeout=cfg.judge.timeout,
+                )
+            )
+
+    answering = asyncio.create_task(answer_task())
+    try:
+        await judge_task()
+    except Exception:
+        # Finish answering, so that the answers are saved, before failing
+        await answering
+        raise
+    await answering
+
+    return answered, evaluated
+
+
+def main(cfg: RunConfig):
+    """
+    Run the answer and judge steps as a pipeline, so that judging starts as
+    soon as the first answers are available. Writes the same files as running
+    the steps one after another.
+    """
+    log.info("Starting to answer questions and judge answers")
+
+    _, evaluated = asyncio.run(answer_and_judge(cfg))
+
+    write_question_answers(evaluated, cfg.paths.evaluated_answers_file)
+    log.info(
+        f"Evaluation complete. Results saved to {cfg.paths.evaluated_answers_file}"
+    )
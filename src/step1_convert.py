@@ -2,6 +2,7 @@ import hashlib
 import logging
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Literal
 from functools import partial
@@ -15,6 +16,9 @@ from src.utils import RunConfig
 
 log = logging.getLogger(__name__)
 
+# Cache lookups and writes are I/O-bound, so threads can overlap them
+CACHE_IO_WORKERS = 32
+
 
 class CacheManager:
     """Manages caching of converted markdown files."""
@@ -24,24 +28,29 @@ class CacheManager:
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         log.debug(f"Using cache directory: {self.cache_dir}")
 
-    def _get_cache_key(
+    def _get_content_hash(self, file_path: str | Path) -> str:
+        """Return the SHA-256 hex digest of the file's bytes."""
+        with open(file_path, "rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+
+    def cache_key(
         self,
-        file_path: str,
+        file_path: str | Path,
         lib: Literal["markitdown", "docling", "zerox", "marker"],
         model: str | None,
     ) -> str:
         """
         Generate a unique hash for a converted markdown result.
-        The hash is unique by file content, library and model used.
+        The hash is unique by file content, library and model used, so
+        identical files are found in the cache regardless of path or mtime.
+        Hashing reads the whole file, so compute the key once and use it with
+        get_by_key() and put_by_key() when doing both for the same file.
         """
         model_str = model or "no_model"
+        content_hash = self._get_content_hash(file_path)
 
-        file_stat = os.stat(file_path)
-        # Use basename in key to avoid path-dependent keys
-        file_basename = os.path.basename(file_path)
-
-        cache_key_data = f"{file_basename}_{file_stat.st_mtime}_{lib}_{model_str}"
-        return hashlib.md5(cache_key_data.encode()).hexdigest()
+        cache_key_data = f"{content_hash}_{lib}_{model_str}"
+        return hashlib.blake2b(cache_key_data.encode(), digest_size=16).hexdigest()
 
     @validate_call
     def get(
@@ -60,25 +69,33 @@ class CacheManager:
             retry_cached_failures: If True, return None for lookups where the
                 cached result indicates a conversion error.
         """
-        cache_key = self._get_cache_key(file_path, lib, model)
+        cache_key = self.cache_key(file_path, lib, model)
+        return self.get_by_key(
+            cache_key=cache_key, retry_cached_failures=retry_cached_failures
+        )
+
+    def get_by_key(
+        self, cache_key: str, retry_cached_failures: bool = True
+    ) -> str | None:
+        """Check for a cached result under a key from cache_key()."""
         cache_file = self.cache_dir / f"{cache_key}.md"
 
-        if cache_file.exists():
-            text = cache_file.read_text()
-            if retry_cached_failures and text.startswith("Error converting"):
-                log.info(
-                    f"Skipping cached result for {os.path.basename(file_path)} (cached file: {cache_file}) because it has a conversion error"
-                )
-                return None
-            else:
-                log.info(
-                    f"Using cached result for {os.path.basename(file_path)} (cached file: {cache_file})"
-                )
-                return text
-        else:
-            log.debug(f"No cached result found for {os.path.basename(file_path)}")
+        if not cache_file.exists():
+            log.debug(f"No cached result found with key {cache_key}")
+            return None
+
+        # Check the first bytes so failed conversions aren't read in full
+        with open(cache_file, "rb") as f:
+            head = f.read(32)
+        if retry_cached_failures and head.startswith(b"Error converting"):
+            log.info(
+                f"Skipping cached result {cache_file} because it has a conversion error"
+            )
             return None
 
+        log.info(f"Using cached result {cache_file}")
+        return cache_file.read_text()
+
     @validate_call
     def put(
         self,
@@ -88,12 +105,14 @@ class CacheManager:
         model: str | None,
     ):
         """Cache a new markdown result."""
-        cache_key = self._get_cache_key(file_path, lib, model)
+        cache_key = self.cache_key(file_path, lib, model)
+        self.put_by_key(md_string=md_string, cache_key=cache_key)
+
+    def put_by_key(self, md_string: str, cache_key: str):
+        """Cache a new markdown result under a key from cache_key()."""
         cache_file = self.cache_dir / f"{cache_key}.md"
         cache_file.write_text(md_string)
-        log.debug(
-            f"Cached result for {os.path.basename(file_path)} with key {cache_key}"
-        )
+        log.debug(f"Cached result with key {cache_key}")
 
 
 def get_report_files(report_dir: str | Path, suffix: str | None = None) -> list[str]:
@@ -102,30 +121,20 @@ def get_report_files(report_dir: str | Path, suffix: str | None = None) -> list[
     or files with specified suffix. Files are sorted alphabetically.
     """
     log.info(f"Scanning for report files in {report_dir}")
-    report_dir = Path(report_dir)
-    if suffix is None:
-        patterns = ["**/*.pdf", "**/*.pptx"]
-        report_files = []
-        for pattern in patterns:
-            report_files.extend(str(p) for p in report_dir.glob(pattern))
-    else:
-        report_files = [str(p) for p in report_dir.glob(f"**/*{suffix}")]
+    suffixes = (".pdf", ".pptx") if suffix is None else (suffix,)
+
+    # Walk the tree once and match all suffixes in the same pass
+    report_files = [
+        os.path.join(dirpath, filename)
+        for dirpath, _, filenames in os.walk(report_dir)
+        for filename in filenames
+        if filename.endswith(suffixes)
+    ]
 
     report_files.sort()
     return report_files
 
 
-def generate_md_path(file, markdown_dir):
-    # Get the base filename without extension and create markdown path
-    basename_split = os.path.splitext(os.path.basename(file))
-    filename = basename_split[0]
-    file_extension = basename_split[1].replace(".", "")
-
-    md_path = os.path.join(markdown_dir, f"{filename}_from_{file_extension}.md")
-
-    return md_path
-
-
 def main(cfg: RunConfig):
     """Convert reports to markdown format"""
 
@@ -134,20 +143,19 @@ def main(cfg: RunConfig):
     # Find files
     files = get_report_files(cfg.paths.reports_dir, suffix=cfg.convert.suffix)
 
-    gen_md_path = partial(generate_md_path, markdown_dir=cfg.paths.markdown_dir)
-
     # Use a data frame to organize file metadata
+    # The markdown path is built from the base filename and its extension,
+    # e.g. report.pdf -> {markdown_dir}/report_from_pdf.md
     files_df = (
-        pl.DataFrame({"file": files})
+        pl.DataFrame({"file": files}, schema={"file": pl.Utf8})
+        .with_columns(pl.col("file").str.split("/").list.last().alias("file_basename"))
         .with_columns(
-            pl.col("file")
-            .map_elements(os.path.basename, return_dtype=pl.Utf8)
-            .alias("file_basename")
-        )
-        .with_columns(
-            pl.col("file_basename")
-            .map_elements(gen_md_path, return_dtype=pl.Utf8)
-            .alias("md_path")
+            pl.format(
+                "{}/{}_from_{}.md",
+                pl.lit(str(cfg.paths.markdown_dir)),
+                pl.col("file_basename").str.extract(r"^(.+)\.[^.]+$", 1),
+                pl.col("file_basename").str.extract(r"\.([^.]+)$", 1),
+            ).alias("md_path")
         )
     )
 
@@ -166,20 +174,37 @@ def main(cfg: RunConfig):
     else:
         log.info(f"Using all {files_df.height} files")
 
+    # Hash each file once; the keys are used for both cache lookups and writes
+    if cfg.convert.read_cache or cfg.convert.write_cache:
+        cache = CacheManager(cfg.paths.cache_dir)
+        key_getter = partial(
+            cache.cache_key, lib=cfg.convert.lib.value, model=cfg.convert.model
+        )
+
+        files = files_df.get_column("file").to_list()
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(CACHE_IO_WORKERS, len(files)))
+        ) as executor:
+            cache_keys = list(executor.map(key_getter, files))
+
+        files_df = files_df.with_columns(
+            pl.Series(name="cache_key", values=cache_keys, dtype=pl.Utf8)
+        )
+
     # Find cached markdown files
     if cfg.convert.read_cache:
-        cache = CacheManager(cfg.paths.cache_dir)
         cache_getter = partial(
-            cache.get,
-            lib=cfg.convert.lib.value,
-            model=cfg.convert.model,
+            cache.get_by_key,
             retry_cached_failures=cfg.convert.retry_cached_failures,
         )
 
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(CACHE_IO_WORKERS, len(cache_keys)))
+        ) as executor:
+            cached_md_strings = list(executor.map(cache_getter, cache_keys))
+
         files_df = files_df.with_columns(
-            pl.col("file")
-            .map_elements(cache_getter, return_dtype=pl.Utf8)
-            .alias("md_string")
+            pl.Series(name="md_string", values=cached_md_strings, dtype=pl.Utf8)
         ).with_columns(pl.col("md_string").is_not_null().alias("read_from_cache"))
 
         n_cached = files_df["read_from_cache"].sum()
@@ -196,14 +221,14 @@ def main(cfg: RunConfig):
         log.info("Skipping cached markdown files lookup")
 
     # Identify the files that need to be converted
-    files_to_convert = files_df.filter(~pl.col("read_from_cache"))
+    files_to_convert = files_df.with_row_index().filter(~pl.col("read_from_cache"))
 
     if files_to_convert.height > 0:
         start_time = time.time()
 
         with app.run():
             md_strings = batch_convert(
-                files=files_to_convert.get_column("file_basename").to_list(),
+                files=files_to_convert.get_column("file").to_list(),
                 lib=cfg.convert.lib.value,
                 model=cfg.convert.model,
                 img_prompt=cfg.convert.img_prompt,
@@ -215,14 +240,13 @@ def main(cfg: RunConfig):
             f"Converted {len(files_to_convert)} documents to markdown in {conversion_time:.2f}s ({seconds_per_file:.2f}s/document)"
         )
 
-        files_to_convert = files_to_convert.with_columns(
-            pl.Series(name="md_string", values=md_strings, dtype=pl.Utf8)
+        # Put the result strings back into the files_df by position
+        all_md_strings = files_df.get_column("md_string").to_list()
+        for i, md_string in zip(files_to_convert.get_column("index"), md_strings):
+            all_md_strings[i] = md_string
+        files_df = files_df.with_columns(
+            pl.Series(name="md_string", values=all_md_strings, dtype=pl.Utf8)
         )
-
-        # Put the result strings back into the files_df
-        files_df = files_df.join(
-            files_to_convert.select("file", "md_string"), on="file", how="left"
-        ).with_columns(pl.coalesce("md_string_right", "md_string").alias("md_string"))
     else:
         log.info(f"All {files_df.height} files were found in cache")
 
@@ -230,19 +254,24 @@ def main(cfg: RunConfig):
 
     # Write all results to output dir
     os.makedirs(cfg.paths.markdown_dir, exist_ok=True)
-    for row in files_df.to_dicts():
-        with open(row["md_path"], "w") as f:
-            f.write(row["md_string"])
+    rows = files_df.select("md_path", "md_string").iter_rows()
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(CACHE_IO_WORKERS, files_df.height))
+    ) as executor:
+        list(executor.map(lambda row: Path(row[0]).write_text(row[1]), rows))
 
     # Copy new results to cache
     if cfg.convert.write_cache:
-        cache = CacheManager(cfg.paths.cache_dir)
-        for row in files_df.filter(~pl.col("read_from_cache")).to_dicts():
-            cache.put(
-                md_string=row["md_string"],
-                file_path=row["file"],
-                lib=cfg.convert.lib.value,
-                model=cfg.convert.model,
+        new_rows = files_df.filter(~pl.col("read_from_cache"))
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(CACHE_IO_WORKERS, new_rows.height))
+        ) as executor:
+            list(
+                executor.map(
+                    lambda row: cache.put_by_key(md_string=row[0], cache_key=row[1]),
+                    new_rows.select("md_string", "cache_key").iter_rows(),
+                )
             )
     else:
         log.debug("Skipping writing to cache")
@@ -1,41 +1,76 @@
-import json
+import asyncio
 import logging
+import mmap
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import orjson
 from dotenv import load_dotenv
+from pydantic import TypeAdapter
 
 from src.utils import (
+    PromptTemplate,
     Question,
     QuestionAnswer,
     ReportAnswer,
     RunConfig,
-    write_json,
+    write_question_answers,
 )
-from src.llm import batch_completion
+from src.llm import DEFAULT_WORKERS, abatch_completion
 
 log = logging.getLogger(__name__)
 
+# Reading reports is I/O-bound, so threads can overlap the reads
+REPORT_READ_WORKERS = 32
+
+# Start of the markdown written for reports that failed to convert
+CONVERSION_ERROR_PREFIX = b"Error converting"
+
+# Validates a whole list of questions in one call
+_QUESTIONS_ADAPTER = TypeAdapter(list[Question])
+
 load_dotenv()
 
 
 def load_questions(questions_file: str | Path) -> list[Question]:
     """Load questions from a JSON file and validate using Pydantic."""
     log.info(f"Loading questions from {questions_file}")
-    with open(questions_file, "r") as f:
-        questions_data = json.load(f)
+    questions_data = orjson.loads(Path(questions_file).read_bytes())
 
-    questions = [Question(**q_data) for q_data in questions_data]
+    questions = _QUESTIONS_ADAPTER.validate_python(questions_data)
     log.info(f"Loaded and validated {len(questions)} questions")
     return questions
 
 
-def find_matching_reports(reports_dir: str | Path, report_name: str) -> list[str]:
-    """Find all .md report files starting with the given report_name."""
-    matching_reports = []
-    for filename in os.listdir(reports_dir):
-        if filename.startswith(report_name + "_from") and filename.endswith(".md"):
-            matching_reports.append(os.path.join(reports_dir, filename))
+def index_reports(reports_dir: str | Path) -> dict[str, list[str]]:
+    """
+    Scan the reports directory once and group the .md report files by report
+    name, i.e. the part of the filename before "_from_".
+    """
+    reports_index: dict[str, list[str]] = {}
+    with os.scandir(reports_dir) as entries:
+        for entry in entries:
+            # is_file() uses the type from the directory listing, not a stat call
+            if (
+                entry.name.endswith(".md")
+                and "_from_" in entry.name
+                and entry.is_file()
+            ):
+                report_name = entry.name.rsplit("_from_", 1)[0]
+                reports_index.setdefault(report_name, []).append(entry.path)
+
+    for paths in reports_index.values():
+        paths.sort()
+
+    return reports_index
+
+
+def find_matching_reports(
+    reports_index: dict[str, list[str]], report_name: str
+) -> list[str]:
+    """Find all .md report files for the given report_name in the index."""
+    matching_reports = reports_index.get(report_name, [])
 
     if not matching_reports:
         log.debug(f"No matching reports found for {report_name}")
@@ -45,48 +80,161 @@ def find_matching_reports(reports_dir: str | Path, report_name: str) -> list[str
     return matching_reports
 
 
-def read_report_content(report_path: str | Path) -> str:
-    """Read the content of a report file."""
+def read_converted_report(report_path: str | Path) -> str | None:
+    """
+    Read the content of a successfully converted report. Returns None if the
+    conversion failed, which is detected from the first bytes of the file, so
+    these reports are not decoded. The file is memory-mapped and decoded
+    straight from the mapping, so no intermediate bytes copy is made.
+    """
     log.debug(f"Reading report: {report_path}")
-    with open(report_path, "r", encoding="utf-8") as f:
-        content = f.read()
+    with open(report_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[: len(CONVERSION_ERROR_PREFIX)] == CONVERSION_ERROR_PREFIX:
+                return None
+            content = str(mm, "utf-8")
+
+    # Match the newline translation of reading in text mode
+    if "\r" in content:
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
     return content
 
 
+# Placeholder that can't occur in a prompt, used to split it around the report
+REPORT_CONTENT_MARKER = "\x00report_content\x00"
+
+
+def split_answer_prompt(prompt: PromptTemplate, question: str) -> list[str]:
+    """
+    Fill the question into the prompt and split it where the report content
+    goes. Joining the parts with a report's content gives the same result as
+    rendering the prompt with both values.
+    """
+    filled = prompt.render(question=question, report_content=REPORT_CONTENT_MARKER)
+    return filled.split(REPORT_CONTENT_MARKER)
+
+
+def create_answer_chat(
+    prompt_parts: list[str], report_content: str, system_prompt: str | None = None
+) -> list[dict[str, str]]:
+    """Create a chat from the parts made by split_answer_prompt and a report."""
+    chat = []
+    if system_prompt is not None:
+        chat.append({"role": "system", "content": system_prompt})
+    chat.append({"role": "user", "content": report_content.join(prompt_parts)})
+    return chat
+
+
 def process_questions(
     questions: list[Question],
     reports_dir: str | Path,
     model: str,
     prompt: str,
     temperature: float,
+    concurrency: int | None = None,
+    system_prompt: str | None = None,
+    max_output_tokens: int | None = None,
+    timeout: float = 300.0,
 ) -> list[QuestionAnswer]:
     """Process all questions against matching reports."""
+    return asyncio.run(
+        aprocess_questions(
+            questions=questions,
+            reports_dir=reports_dir,
+            model=model,
+            prompt=prompt,
+            temperature=temperature,
+            concurrency=concurrency,
+            system_prompt=system_prompt,
+            max_output_tokens=max_output_tokens,
+            timeout=timeout,
+        )
+    )
+
+
+async def aprocess_questions(
+    questions: list[Question],
+    reports_dir: str | Path,
+    model: str,
+    prompt: str,
+    temperature: float,
+    concurrency: int | None = None,
+    system_prompt: str | None = None,
+    max_output_tokens: int | None = None,
+    timeout: float = 300.0,
+    reports_index: dict[str, list[str]] | None = None,
+    report_contents: dict[str, str | None] | None = None,
+) -> list[QuestionAnswer]:
+    """
+    Process all questions against matching reports. Async version.
+
+    When called repeatedly on parts of the questions, pass the result of
+    index_reports as reports_index to scan the directory only once, and a
+    shared report_contents dict, which caches report contents by path (None
+    for failed conversions), to read each report only once.
+    """
     question_answers = []
     chats_to_process = []
-    chat_metadata = []
+    # For each chat, the index of its question in question_answers and the
+    # report it was created from
+    chat_qa_indices: list[int] = []
+    chat_report_filenames: list[str] = []
+    prompt_template = PromptTemplate(prompt)
+
+    # Disk I/O runs in threads, so that it doesn't block other coroutines on
+    # the event loop, e.g. judge completions when running as a pipeline
+    if reports_index is None:
+        reports_index = await asyncio.to_thread(index_reports, reports_dir)
+    if report_contents is None:
+        report_contents = {}
+
+    # Many questions refer to the same report, so each report is read once.
+    # The reads run in a thread pool to overlap disk I/O.
+    report_paths = sorted(
+        {
+            path
+            for question in questions
+            for path in reports_index.get(question.report_name, [])
+            if path not in report_contents
+        }
+    )
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=REPORT_READ_WORKERS) as executor:
+        contents = await asyncio.gather(
+            *[
+                loop.run_in_executor(executor, read_converted_report, path)
+                for path in report_paths
+            ]
+        )
+    report_contents.update(zip(report_paths, contents))
 
     # Find matching reports and prepare chats
-    for question in questions:
-        question_answer = QuestionAnswer(**question.model_dump())
+    for qa_index, question in enumerate(questions):
+        # The question is already validated, so skip re-validating its fields
+        question_answer = QuestionAnswer.model_construct(**dict(question))
         question_answers.append(question_answer)
 
         log.debug(
             f"Processing question_id: {question.question_id}, report_name: {question.report_name}"
         )
 
-        matching_reports = find_matching_reports(reports_dir, question.report_name)
+        matching_reports = find_matching_reports(reports_index, question.report_name)
         if not matching_reports:
             log.debug(
                 f"No matching reports found for {question.report_name} (question_id: {question.question_id})"
             )
             continue
 
+        prompt_parts = split_answer_prompt(prompt_template, question.question)
+
         # Add a chat for each converted report
         for report_path in matching_reports:
-            content = read_report_content(report_path)
+            content = report_contents[report_path]
             report_filename = os.path.basename(report_path)
 
-            if content.startswith("Error converting"):
+            if content is None:
                 # This means the report was not converted successfully
                 # There is no point in using it for answering questions
                 log.info(
@@ -102,37 +250,47 @@ def process_questions(
                 continue
 
             # Create chat
-            chat = [
-                {
-                    "role": "user",
-                    "content": prompt.format(
-                        question=question.question, report_content=content
-                    ),
-                }
-            ]
-            chats_to_process.append(chat)
-            chat_metadata.append(
-                {"question_answer": question_answer, "report_filename": report_filename}
+            chat = create_answer_chat(
+                prompt_parts=prompt_parts,
+                report_content=content,
+                system_prompt=system_prompt,
             )
+            chats_to_process.append(chat)
+            chat_qa_indices.append(qa_index)
+            chat_report_filenames.append(report_filename)
 
     if not chats_to_process:
         log.info("No valid reports found to generate answers from.")
         return question_answers
 
     log.info(f"Processing {len(chats_to_process)} chats with {model}")
-    responses = batch_completion(
-        chats=chats_to_process, model=model, temperature=temperature
+    responses = await abatch_completion(
+        chats=chats_to_process,
+        model=model,
+        temperature=temperature,
+        timeout=timeout,
+        workers=concurrency or DEFAULT_WORKERS,
+        max_tokens=max_output_tokens,
     )
 
     # Store model answers in the report_answer objects
-    for response, metadata in zip(responses, chat_metadata):
-        answer_content = response.choices[0].message.content
+    for response, qa_index, report_filename in zip(
+        responses, chat_qa_indices, chat_report_filenames
+    ):
+        choice = response.choices[0]
+        truncated = choice.finish_reason == "length"
+        if truncated:
+            log.warning(
+                f"Answer for question {question_answers[qa_index].question_id} "
+                f"from {report_filename} was cut off at max_output_tokens"
+            )
         report_answer = ReportAnswer(
-            report_filename=metadata["report_filename"],
-            answer=answer_content,
+            report_filename=report_filename,
+            answer=choice.message.content,
             model=model,
+            truncated=truncated,
         )
-        metadata["question_answer"].report_answers.append(report_answer)
+        question_answers[qa_index].report_answers.append(report_answer)
 
     return question_answers
 
@@ -152,9 +310,12 @@ def main(cfg: RunConfig):
         model=cfg.answer.model,
         prompt=cfg.answer.prompt,
         temperature=cfg.answer.temperature,
+        concurrency=cfg.answer.concurrency,
+        system_prompt=cfg.answer.system_prompt,
+        max_output_tokens=cfg.answer.max_output_tokens,
+        timeout=cfg.answer.timeout,
     )
 
-    result_dicts = [result.model_dump() for result in results]
-    write_json(result_dicts, cfg.paths.answers_file)
+    write_question_answers(results, cfg.paths.answers_file)
 
     log.info(f"Answers generated successfully and saved to {cfg.paths.answers_file}")
@@ -1,20 +1,33 @@
+import asyncio
+import hashlib
 import json
 import logging
+import re
 from pathlib import Path
 from typing import Any
 
+import orjson
 from dotenv import load_dotenv
+from pydantic import TypeAdapter
 
-from src.llm import batch_completion
+from src.llm import DEFAULT_WORKERS, abatch_completion
 from src.utils import (
     Evaluation,
+    PromptTemplate,
     QuestionAnswer,
     RunConfig,
-    write_json,
+    write_question_answers,
 )
 
 log = logging.getLogger(__name__)
 
+# A trailing comma at the end of the arguments, optionally before the final
+# closing brace. Only the end is matched so string values stay untouched.
+TRAILING_COMMA_PATTERN = re.compile(r",\s*(\}?)$")
+
+# Validates a whole list of questions with answers in one call
+_ANSWERS_ADAPTER = TypeAdapter(list[QuestionAnswer])
+
 load_dotenv()
 
 TOOLS = [
@@ -43,52 +56,104 @@ TOOLS = [
 
 
 def create_eval_chat(
-    question: str, answer: str, ground_truth: str, prompt: str
+    question: str,
+    answer: str,
+    ground_truth: str,
+    prompt: PromptTemplate,
+    system_prompt: str | None = None,
 ) -> list[dict[str, str]]:
-    """Create a chat for evaluation."""
-    return [
+    """Create a chat for evaluation with an optional system message."""
+    chat = []
+    if system_prompt is not None:
+        chat.append({"content": system_prompt, "role": "system"})
+    chat.append(
         {
-            "content": prompt.format(
+            "content": prompt.render(
                 question=question, answer=answer, ground_truth=ground_truth
             ),
             "role": "user",
         }
-    ]
+    )
+    return chat
 
 
 def load_answers(answers_file: str | Path) -> list[QuestionAnswer]:
-    """Load answers from a JSON file and validate using Pydantic."""
+    """
+    Load answers from a JSON file and validate using Pydantic. The file is
+    parsed and validated in a single pass, without building Python dicts first.
+    """
     log.info(f"Loading answers from {answers_file}")
-    with open(answers_file, "r") as f:
-        data = json.load(f)
-
-    questions = []
-    for q_data in data:
-        question = QuestionAnswer(**q_data)
-        questions.append(question)
+    questions = _ANSWERS_ADAPTER.validate_json(Path(answers_file).read_bytes())
 
     log.info(f"Loaded and validated {len(questions)} questions with answers")
     return questions
 
 
 def parse_eval_response(response: dict[str, Any]) -> dict[str, Any]:
-    tool_call = response.choices[0].message.tool_calls[0]
+    choice = response.choices[0]
+    # Arguments cut off at the output token limit can't be repaired reliably
+    if choice.finish_reason == "length":
+        raise ValueError("Evaluation response exceeded max_output_tokens")
+
+    tool_call = choice.message.tool_calls[0]
     args_str = tool_call.function.arguments
 
-    # Fix a common error where the JSON string is not properly terminated
-    if args_str[-1] != "}":
+    # Most responses are valid JSON
+    try:
+        return orjson.loads(args_str)
+    except orjson.JSONDecodeError:
+        log.debug(f"Repairing malformed tool call arguments: {args_str}")
+
+    # Fix common errors where the JSON string is not properly terminated or
+    # has trailing commas
+    args_str = TRAILING_COMMA_PATTERN.sub(r"\1", args_str.rstrip())
+    if not args_str.endswith("}"):
         args_str += "}"
 
-    return json.loads(args_str)
+    # Allow control characters such as raw newlines inside strings
+    return json.loads(args_str, strict=False)
 
 
 def process_evaluations(
-    questions: list[QuestionAnswer], model: str, prompt: str
+    questions: list[QuestionAnswer],
+    model: str,
+    prompt: str,
+    concurrency: int | None = None,
+    system_prompt: str | None = None,
+    max_output_tokens: int | None = None,
+    timeout: float = 300.0,
 ) -> list[QuestionAnswer]:
     """Process all answers and evaluate them against ground truth."""
+    return asyncio.run(
+        aprocess_evaluations(
+            questions=questions,
+            model=model,
+            prompt=prompt,
+            concurrency=concurrency,
+            system_prompt=system_prompt,
+            max_output_tokens=max_output_tokens,
+            timeout=timeout,
+        )
+    )
+
+
+async def aprocess_evaluations(
+    questions: list[QuestionAnswer],
+    model: str,
+    prompt: str,
+    concurrency: int | None = None,
+    system_prompt: str | None = None,
+    max_output_tokens: int | None = None,
+    timeout: float = 300.0,
+) -> list[QuestionAnswer]:
+    """Process all answers and evaluate them against ground truth. Async version."""
     # Prepare evaluation requests
     eval_chats = []
     eval_metadata = []
+    prompt_template = PromptTemplate(prompt)
+    # Identical answers to the same question (e.g. from different reports)
+    # share one evaluation. Maps (question_id, answer hash) to the chat index.
+    seen: dict[tuple[str, bytes], int] = {}
 
     # Build evaluation requests
     for question in questions:
@@ -102,34 +167,49 @@ def process_evaluations(
                 )
                 continue
 
+            answer_hash = hashlib.blake2b(
+                answer.answer.encode(), digest_size=16
+            ).digest()
+            key = (question.question_id, answer_hash)
+            if key in seen:
+                eval_metadata[seen[key]]["answers"].append(answer)
+                continue
+            seen[key] = len(eval_chats)
+
             eval_chats.append(
                 create_eval_chat(
                     question=question.question,
                     answer=answer.answer,
                     ground_truth=question.ground_truth,
-                    prompt=prompt,
+                    prompt=prompt_template,
+                    system_prompt=system_prompt,
                 )
             )
             eval_metadata.append(
-                {"answer": answer, "question_id": question.question_id}
+                {"answers": [answer], "question_id": question.question_id}
             )
 
-    log.info(f"Processing {len(eval_chats)} evaluations with {model}")
+    n_answers = sum(len(metadata["answers"]) for metadata in eval_metadata)
+    log.info(
+        f"Processing {len(eval_chats)} evaluations for {n_answers} answers with {model}"
+    )
 
     # Get evaluations in batch
-    responses = batch_completion(
+    responses = await abatch_completion(
         chats=eval_chats,
         model=model,
         tools=TOOLS,
         tool_choice={"type": "function", "function": {"name": "answer"}},
+        timeout=timeout,
+        workers=concurrency or DEFAULT_WORKERS,
+        max_tokens=max_output_tokens,
     )
 
-    # Process responses
+    # Process responses and copy each evaluation to all answers it covers
     for metadata, response in zip(eval_metadata, responses):
-        answer = metadata["answer"]
         try:
             result = parse_eval_response(response)
-            answer.evaluation = Evaluation(
+            evaluation = Evaluation(
                 reasoning=result["reasoning"], correct=result["correct"]
             )
 
@@ -137,10 +217,13 @@ def process_evaluations(
             log.error(
                 f"Error processing evaluation for question {metadata['question_id']}: {e}"
             )
-            answer.evaluation = Evaluation(
+            evaluation = Evaluation(
                 reasoning=f"EVALUATION_ERROR: {str(e)}", correct=False
             )
 
+        for answer in metadata["answers"]:
+            answer.evaluation = evaluation.model_copy()
+
     return questions
 
 
@@ -156,10 +239,13 @@ def main(cfg: RunConfig):
         questions=questions,
         model=cfg.judge.model,
         prompt=cfg.judge.prompt,
+        concurrency=cfg.judge.concurrency,
+        system_prompt=cfg.judge.system_prompt,
+        max_output_tokens=cfg.judge.max_output_tokens,
+        timeout=cfg.judge.timeout,
     )
 
-    result_dicts = [question.model_dump() for question in evaluated_questions]
-    write_json(result_dicts, cfg.paths.evaluated_answers_file)
+    write_question_answers(evaluated_questions, cfg.paths.evaluated_answers_file)
 
     log.info(
         f"Evaluation complete. Results saved to {cfg.paths.evaluated_answers_file}"
@@ -1,10 +1,13 @@
-import json
+import os
+import string
+from collections.abc import Iterator
+from contextlib import contextmanager
 from enum import Enum
 from pathlib import Path
-from typing import Any
+from typing import BinaryIO
 
 import yaml
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
 from pydantic.dataclasses import dataclass
 
 
@@ -23,6 +26,8 @@ class StepsConfig:
     convert: bool
     answer: bool
     judge: bool
+    # Judge answers while further questions are still being answered
+    pipeline: bool = False
 
 
 class ConversionLib(str, Enum):
@@ -64,6 +69,14 @@ class AnswerConfig:
     model: str
     temperature: float
     prompt: str
+    # Optional system message sent before the prompt
+    system_prompt: str | None = None
+    # Maximum number of concurrent requests, defaults to LITELLM_WORKERS
+    concurrency: int | None = None
+    # Maximum number of tokens the model may generate per response
+    max_output_tokens: int | None = None
+    # Timeout in seconds for an individual completion
+    timeout: float = 300.0
 
     @field_validator("temperature")
     @classmethod
@@ -79,11 +92,40 @@ class AnswerConfig:
             raise ValueError("Prompt must contain {report_content} and {question}")
         return v
 
+    @field_validator("concurrency")
+    @classmethod
+    def validate_concurrency(cls, v: int | None) -> int | None:
+        if v is not None and v < 1:
+            raise ValueError(f"Invalid concurrency: {v}")
+        return v
+
+    @field_validator("max_output_tokens")
+    @classmethod
+    def validate_max_output_tokens(cls, v: int | None) -> int | None:
+        if v is not None and v < 1:
+            raise ValueError(f"Invalid max_output_tokens: {v}")
+        return v
+
+    @field_validator("timeout")
+    @classmethod
+    def validate_timeout(cls, v: float) -> float:
+        if v <= 0:
+            raise ValueError(f"Invalid timeout: {v}")
+        return v
+
 
 @dataclass
 class JudgeConfig:
     model: str
     prompt: str
+    # Optional system message sent before the prompt
+    system_prompt: str | None = None
+    # Maximum number of concurrent requests, defaults to LITELLM_WORKERS
+    concurrency: int | None = None
+    # Maximum number of tokens the model may generate per response
+    max_output_tokens: int | None = None
+    # Timeout in seconds for an individual completion
+    timeout: float = 300.0
 
     @field_validator("prompt")
     @classmethod
@@ -92,6 +134,27 @@ class JudgeConfig:
             raise ValueError("Prompt must contain {answer} and {ground_truth}")
         return v
 
+    @field_validator("concurrency")
+    @classmethod
+    def validate_concurrency(cls, v: int | None) -> int | None:
+        if v is not None and v < 1:
+            raise ValueError(f"Invalid concurrency: {v}")
+        return v
+
+    @field_validator("max_output_tokens")
+    @classmethod
+    def validate_max_output_tokens(cls, v: int | None) -> int | None:
+        if v is not None and v < 1:
+            raise ValueError(f"Invalid max_output_tokens: {v}")
+        return v
+
+    @field_validator("timeout")
+    @classmethod
+    def validate_timeout(cls, v: float) -> float:
+        if v <= 0:
+            raise ValueError(f"Invalid timeout: {v}")
+        return v
+
     @field_validator("temperature")
     @classmethod
     def validate_temperature(cls, v: float) -> float:
@@ -118,6 +181,33 @@ class RunConfig:
         return cls(**cfg)
 
 
+class PromptTemplate:
+    """
+    A prompt with str.format-style placeholders that is parsed once and then
+    rendered by concatenation, without parsing the template on every call.
+    Only plain placeholders like {question} are supported.
+    """
+
+    def __init__(self, template: str):
+        self.segments = []
+        for literal, field, format_spec, conversion in string.Formatter().parse(
+            template
+        ):
+            if field is not None and (
+                not field.isidentifier() or format_spec or conversion
+            ):
+                raise ValueError(f"Unsupported placeholder in prompt: {{{field}}}")
+            self.segments.append((literal, field))
+
+    def render(self, **kwargs: str) -> str:
+        parts = []
+        for literal, field in self.segments:
+            parts.append(literal)
+            if field is not None:
+                parts.append(kwargs[field])
+        return "".join(parts)
+
+
 class Question(BaseModel):
     """Pydantic model for a question"""
 
@@ -150,6 +240,8 @@ class ReportAnswer(BaseModel):
     answer: str
     model: str
     conversion_error: bool = False
+    # Whether the answer was cut off at answer.max_output_tokens
+    truncated: bool = False
     evaluation: Evaluation | None = None
 
 
@@ -159,6 +251,38 @@ class QuestionAnswer(Question):
     report_answers: list[ReportAnswer] = Field(default_factory=list)
 
 
-def write_json(data: Any, file_path: str | Path):
-    with open(file_path, "w") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+# Serializes a result straight to JSON bytes, without an intermediate dict
+_QUESTION_ANSWER_ADAPTER = TypeAdapter(QuestionAnswer)
+
+
+@contextmanager
+def atomic_write(file_path: str | Path) -> Iterator[BinaryIO]:
+    """
+    Open a temporary file next to file_path for writing in binary mode and move
+    it into place once writing is done. An interrupted write leaves any
+    previous file intact instead of a truncated one.
+    """
+    file_path = Path(file_path)
+    tmp_path = file_path.with_suffix(file_path.suffix + ".tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def write_question_answers(results: list[QuestionAnswer], file_path: str | Path):
+    """
+    Write questions with their answers to a JSON file. The array is written one
+    result at a time, so only one serialized result is held at any point.
+    """
+    with atomic_write(file_path) as f:
+        f.write(b"[")
+        for i, result in enumerate(results):
+            f.write(b",\n" if i > 0 else b"\n")
+            f.write(_QUESTION_ANSWER_ADAPTER.dump_json(result, indent=2))
+        f.write(b"\n]" if results else b"]")